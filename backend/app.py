@@ -5,33 +5,115 @@ University Assignment - UCF11 Dataset
 
 import os
 import json
-from flask import Flask, request, jsonify
+import queue
+import hashlib
+import threading
+
+import numpy as np
+from flask import Flask, Response, request, jsonify
 from flask_cors import CORS
-from werkzeug.utils import secure_filename
+from werkzeug.exceptions import HTTPException
+
+# Optional faster serializers for the /predict hot path
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
-from model_loader import load_model, get_class_labels
-from video_utils import extract_frames, preprocess_video
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+from model_loader import (
+    load_model, get_predict_fn, get_class_labels,
+    get_cached_prediction, cache_prediction
+)
+from video_utils import (
+    extract_frames, extract_frames_from_stream, preprocess_video,
+    upload_tempfile, is_seekable
+)
+from batcher import DynamicBatcher
 
 # Initialize Flask app
 app = Flask(__name__)
 CORS(app)  # Enable CORS for frontend communication
 
 # Configuration
-UPLOAD_FOLDER = 'uploads'
 ALLOWED_EXTENSIONS = {'mp4', 'avi', 'mov', 'mpg', 'mpeg', 'mkv', 'webm'}
 MAX_CONTENT_LENGTH = 100 * 1024 * 1024  # 100MB max file size
+PREDICT_TIMEOUT = 30  # Seconds to wait for a batched prediction
+DECODE_WAIT_TIMEOUT = 60  # Seconds to wait for a free decode slot
+# Concurrent ffmpeg decodes of uploads already spooled to local disk
+# (CPU-bound); kept below the gunicorn thread count so the remaining
+# cores stay free for TensorFlow
+DECODE_WORKERS = int(os.getenv('DECODE_WORKERS', str(max(1, (os.cpu_count() or 2) // 2))))
+# Concurrent raw video/* uploads piped into ffmpeg while still arriving
+# from the client; paced by the network, so a slow uploader must not
+# take one of the CPU decode slots above
+STREAM_WORKERS = int(os.getenv('STREAM_WORKERS', '8'))
 
-app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 app.config['MAX_CONTENT_LENGTH'] = MAX_CONTENT_LENGTH
 
-# Create upload folder if it doesn't exist
-os.makedirs(UPLOAD_FOLDER, exist_ok=True)
-
-# Load model and class labels at startup
-print("Loading CNN + LSTM model...")
-model = load_model()
+# Class labels come from JSON and are available immediately; the model
+# (and TensorFlow) is loaded by get_batcher() so health checks and
+# /classes respond without waiting for it. Under gunicorn that starts in
+# the background when the worker boots (see gunicorn.conf.py)
 class_labels = get_class_labels()
-print(f"Model loaded successfully! Classes: {class_labels}")
+print(f"Classes: {class_labels}")
+
+# Batch concurrent requests into a single forward pass (created with the model)
+_batcher = None
+_batcher_lock = threading.Lock()
+
+# Request threads decode their own uploads (overlapping with the batcher's
+# forward pass); these cap how many do so at once
+decode_slots = threading.BoundedSemaphore(DECODE_WORKERS)
+stream_slots = threading.BoundedSemaphore(STREAM_WORKERS)
+
+
+def get_batcher():
+    """Load the model and start the batcher on first use"""
+    global _batcher
+    
+    if _batcher is None:
+        with _batcher_lock:
+            if _batcher is None:
+                print("Loading CNN + LSTM model...")
+                load_model()
+                _batcher = DynamicBatcher(get_predict_fn())
+    return _batcher
+
+
+def prediction_response(payload):
+    """
+    Serialize a successful prediction payload
+    
+    Clients sending 'Accept: application/x-msgpack' get msgpack; otherwise
+    JSON is encoded with orjson when installed. Falls back to jsonify.
+    """
+    best = request.accept_mimetypes.best_match(
+        ['application/json', 'application/x-msgpack']
+    )
+    if msgpack is not None and best == 'application/x-msgpack':
+        response = Response(msgpack.packb(payload), mimetype='application/x-msgpack')
+    elif orjson is not None:
+        response = Response(orjson.dumps(payload), mimetype='application/json')
+    else:
+        response = jsonify(payload)
+    
+    # The body depends on Accept, so shared caches must key on it
+    response.vary.add('Accept')
+    return response
+
+
+def server_busy():
+    """503 response when no decode slot frees up in time"""
+    return jsonify({
+        'success': False,
+        'error': 'Server busy',
+        'message': 'Too many videos are being processed. Please try again shortly.'
+    }), 503
 
 
 def allowed_file(filename):
@@ -70,92 +152,136 @@ def predict():
     Predict action from uploaded video
     
     Expects:
-        - POST request with video file in 'video' field
+        - POST request with video file in 'video' field, or
+        - POST request with the raw video as body and a video/* Content-Type
+        - Optional '?no_cache=1' to bypass the prediction cache
     
     Returns:
         - JSON with predicted action and confidence scores
     """
     try:
-        # Check if video file is present in request
-        if 'video' not in request.files:
-            return jsonify({
-                'success': False,
-                'error': 'No video file provided',
-                'message': 'Please upload a video file with key "video"'
-            }), 400
+        if request.mimetype.startswith('video/'):
+            # Raw upload: pipe the request body straight into ffmpeg
+            video_stream = request.stream
+        else:
+            # Check if video file is present in request
+            if 'video' not in request.files:
+                return jsonify({
+                    'success': False,
+                    'error': 'No video file provided',
+                    'message': 'Please upload a video file with key "video"'
+                }), 400
+            
+            video_file = request.files['video']
+            
+            # Check if file is selected
+            if video_file.filename == '':
+                return jsonify({
+                    'success': False,
+                    'error': 'No file selected',
+                    'message': 'Please select a video file to upload'
+                }), 400
+            
+            # Check file extension
+            if not allowed_file(video_file.filename):
+                return jsonify({
+                    'success': False,
+                    'error': 'Invalid file type',
+                    'message': f'Allowed formats: {", ".join(ALLOWED_EXTENSIONS)}'
+                }), 400
+            
+            video_stream = video_file.stream
         
-        video_file = request.files['video']
+        use_cache = request.args.get('no_cache') != '1'
+        hasher = hashlib.blake2b(digest_size=16) if use_cache else None
+        cache_key = None
         
-        # Check if file is selected
-        if video_file.filename == '':
-            return jsonify({
-                'success': False,
-                'error': 'No file selected',
-                'message': 'Please select a video file to upload'
-            }), 400
+        if is_seekable(video_stream):
+            # Spooled multipart upload: one pass copies it to a temp file for
+            # ffmpeg and hashes it, so a cache hit skips decoding too
+            with upload_tempfile(video_stream, hasher) as video_path:
+                if hasher is not None:
+                    cache_key = hasher.digest()
+                    cached = get_cached_prediction(cache_key)
+                    if cached is not None:
+                        return prediction_response(cached)
+                
+                # Extract frames
+                if not decode_slots.acquire(timeout=DECODE_WAIT_TIMEOUT):
+                    return server_busy()
+                try:
+                    frames = extract_frames(video_path)
+                finally:
+                    decode_slots.release()
+        else:
+            # Raw body: hash while piping to ffmpeg, a hit skips inference
+            if not stream_slots.acquire(timeout=DECODE_WAIT_TIMEOUT):
+                return server_busy()
+            try:
+                frames = extract_frames_from_stream(video_stream, hasher=hasher)
+            finally:
+                stream_slots.release()
+            if hasher is not None:
+                cache_key = hasher.digest()
         
-        # Check file extension
-        if not allowed_file(video_file.filename):
+        if frames is None:
             return jsonify({
                 'success': False,
-                'error': 'Invalid file type',
-                'message': f'Allowed formats: {", ".join(ALLOWED_EXTENSIONS)}'
+                'error': 'Failed to process video',
+                'message': 'Could not extract frames from video. Please try another file.'
             }), 400
         
-        # Save uploaded file temporarily
-        filename = secure_filename(video_file.filename)
-        filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        video_file.save(filepath)
+        if cache_key is not None:
+            cached = get_cached_prediction(cache_key)
+            if cached is not None:
+                return prediction_response(cached)
+        
+        # Preprocess for model input
+        processed_video = preprocess_video(frames)
         
+        # Make prediction (batched with any concurrent requests)
+        result = get_batcher().submit(processed_video[0])
         try:
-            # Extract and preprocess frames
-            frames = extract_frames(filepath)
-            
-            if frames is None:
-                return jsonify({
-                    'success': False,
-                    'error': 'Failed to process video',
-                    'message': 'Could not extract frames from video. Please try another file.'
-                }), 400
-            
-            # Preprocess for model input
-            processed_video = preprocess_video(frames)
-            
-            # Make prediction
-            predictions = model.predict(processed_video, verbose=0)
-            
-            # Get predicted class
-            predicted_class_idx = int(predictions[0].argmax())
-            confidence = float(predictions[0][predicted_class_idx])
-            predicted_action = class_labels[predicted_class_idx]
-            
-            # Get all class probabilities
-            all_predictions = {
-                class_labels[i]: float(predictions[0][i]) 
-                for i in range(len(class_labels))
-            }
-            
-            # Sort by confidence
-            sorted_predictions = dict(
-                sorted(all_predictions.items(), key=lambda x: x[1], reverse=True)
-            )
-            
+            preds = result.get(timeout=PREDICT_TIMEOUT)
+        except queue.Empty:
             return jsonify({
-                'success': True,
-                'prediction': {
-                    'action': predicted_action,
-                    'confidence': round(confidence * 100, 2),
-                    'class_index': predicted_class_idx
-                },
-                'all_predictions': sorted_predictions,
-                'message': f'Predicted action: {predicted_action} ({confidence*100:.2f}% confidence)'
-            })
-            
-        finally:
-            # Clean up - remove uploaded file
-            if os.path.exists(filepath):
-                os.remove(filepath)
+                'success': False,
+                'error': 'Prediction timed out',
+                'message': f'The model did not respond within {PREDICT_TIMEOUT}s. Please try again.'
+            }), 503
+        if isinstance(preds, Exception):
+            raise preds
+        
+        # Get predicted class
+        predicted_class_idx = int(preds.argmax())
+        confidence = float(preds[predicted_class_idx])
+        predicted_action = class_labels[predicted_class_idx]
+        
+        # All class probabilities, sorted by confidence
+        order = np.argsort(preds)[::-1]
+        sorted_predictions = {
+            class_labels[i]: float(preds[i]) for i in order
+        }
+        
+        payload = {
+            'success': True,
+            'prediction': {
+                'action': predicted_action,
+                'confidence': round(confidence * 100, 2),
+                'class_index': predicted_class_idx
+            },
+            'all_predictions': sorted_predictions,
+            'message': f'Predicted action: {predicted_action} ({confidence*100:.2f}% confidence)'
+        }
+        
+        if cache_key is not None:
+            cache_prediction(cache_key, payload)
+        
+        return prediction_response(payload)
                 
+    except HTTPException:
+        # e.g. client disconnect or body over MAX_CONTENT_LENGTH mid-upload
+        raise
     except Exception as e:
         return jsonify({
             'success': False,
@@ -193,4 +319,11 @@ if __name__ == '__main__':
     print(f"Endpoint: http://127.0.0.1:5000/predict")
     print("="*50 + "\n")
     
-    app.run(debug=True, host='0.0.0.0', port=5000)
+    # Load eagerly for local runs so the first request isn't slow
+    get_batcher()
+    
+    # Local development only; in production run under gunicorn:
+    #   gunicorn -c gunicorn.conf.py app:app
+    # The reloader is left off so the model isn't loaded twice
+    app.run(debug=os.getenv('FLASK_DEBUG') == '1', use_reloader=False,
+            threaded=True, host='0.0.0.0', port=5000)
@@ -0,0 +1,101 @@
+"""
+Dynamic Request Batcher for Action Recognition
+Groups concurrent /predict requests into a single model forward pass
+"""
+
+import os
+import queue
+import threading
+import time
+
+import numpy as np
+
+# Batching configuration (analogous to TF-Serving's batching parameters)
+MAX_BATCH_SIZE = int(os.getenv('MAX_BATCH_SIZE', '8'))
+BATCH_TIMEOUT_MS = float(os.getenv('BATCH_TIMEOUT_MS', '20'))
+NUM_BATCH_THREADS = int(os.getenv('NUM_BATCH_THREADS', '1'))
+
+
+class DynamicBatcher:
+    """
+    Queue incoming video tensors and run them through the model in batches
+
+    Each worker thread:
+    1. Blocks until at least one request is queued
+    2. Keeps collecting requests until max_batch_size is reached
+       or batch_timeout_ms has elapsed since the first one arrived
+    3. Concatenates the tensors along axis 0 and runs one forward pass
+    4. Routes each row of the output back to its caller's result queue
+    """
+
+    def __init__(self, predict_fn, max_batch_size=MAX_BATCH_SIZE,
+                 batch_timeout_ms=BATCH_TIMEOUT_MS,
+                 num_batch_threads=NUM_BATCH_THREADS):
+        """
+        Args:
+            predict_fn: Callable mapping a batch array to a tensor of class probabilities
+            max_batch_size (int): Maximum number of requests per forward pass
+            batch_timeout_ms (float): Maximum time to wait for a batch to fill
+            num_batch_threads (int): Number of worker threads draining the queue
+        """
+        self.predict_fn = predict_fn
+        self.max_batch_size = max(1, max_batch_size)
+        self.batch_timeout = batch_timeout_ms / 1000.0
+        self._queue = queue.Queue()
+        # Keras models are not safe under arbitrary concurrency
+        self._model_lock = threading.Lock()
+        self._threads = []
+
+        for i in range(max(1, num_batch_threads)):
+            thread = threading.Thread(
+                target=self._run, name=f'batcher-{i}', daemon=True
+            )
+            thread.start()
+            self._threads.append(thread)
+
+    def submit(self, tensor):
+        """
+        Queue a single video tensor for prediction
+
+        Args:
+            tensor (numpy.ndarray): Array of shape (seq_length, img_size, img_size, 3)
+
+        Returns:
+            queue.Queue: Receives the prediction row for this tensor,
+                         or the exception raised while predicting
+        """
+        result = queue.Queue(maxsize=1)
+        self._queue.put((tensor, result))
+        return result
+
+    def _collect(self):
+        """Block for the first request, then gather more until full or timed out"""
+        items = [self._queue.get()]
+        t0 = time.monotonic()
+
+        while len(items) < self.max_batch_size:
+            remaining = self.batch_timeout - (time.monotonic() - t0)
+            if remaining <= 0:
+                break
+            try:
+                items.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+
+        return items
+
+    def _run(self):
+        """Worker loop: collect a batch, predict, and dispatch results"""
+        while True:
+            items = self._collect()
+            try:
+                batch = np.stack([tensor for tensor, _ in items], axis=0)
+                # Call the traced function directly rather than model.predict(),
+                # which sets up a full predict loop on every call
+                with self._model_lock:
+                    predictions = np.asarray(self.predict_fn(batch))
+                for i, (_, result) in enumerate(items):
+                    result.put(predictions[i])
+            except Exception as e:
+                for _, result in items:
+                    result.put(e)
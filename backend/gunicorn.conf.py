@@ -0,0 +1,29 @@
+"""
+Gunicorn Configuration for the Action Recognition API
+Usage: gunicorn -c gunicorn.conf.py app:app
+"""
+
+import os
+
+bind = os.getenv('BIND', '0.0.0.0:5000')
+
+# One process keeps a single TensorFlow runtime / GPU context;
+# threads let uploads decode on the CPU while the batcher runs the model
+workers = 1
+worker_class = 'gthread'
+threads = int(os.getenv('GUNICORN_THREADS', '8'))
+
+# Large uploads and first-request model work can be slow
+timeout = 120
+
+
+def post_worker_init(worker):
+    """
+    Load the model in the background as soon as the worker starts, so
+    health checks answer immediately but the first /predict doesn't pay
+    for the TF import, model build and warmup
+    """
+    import threading
+    from app import get_batcher
+
+    threading.Thread(target=get_batcher, name='model-preload', daemon=True).start()
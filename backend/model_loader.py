@@ -5,22 +5,63 @@ Handles loading the pre-trained CNN + LSTM model and class labels
 
 import os
 import json
-import tensorflow as tf
+import hashlib
+import shutil
+import tempfile
+import threading
+from collections import OrderedDict
+import numpy as np
+
+from batcher import MAX_BATCH_SIZE
+
+# TensorFlow is imported lazily inside the functions that need it, so
+# importing this module (e.g. for class labels) stays fast
 
 # Paths
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 MODEL_PATH = os.path.join(BASE_DIR, 'models', 'ucf11_cnn_lstm_model.h5')
 CLASSES_PATH = os.path.join(BASE_DIR, 'models', 'classes.json')
+TRT_CACHE_DIR = os.path.join(BASE_DIR, 'models', 'trt_cache')
+TFLITE_MODEL_PATH = os.path.join(BASE_DIR, 'models', 'ucf11_cnn_lstm_int8.tflite')
+CALIB_DIR = os.path.join(BASE_DIR, 'samples')
+CALIB_EXTENSIONS = {'mp4', 'avi', 'mov', 'mpg', 'mpeg', 'mkv', 'webm'}
+
+# Convert the model to a TF-TRT FP16 engine (requires TensorRT + GPU)
+USE_TENSORRT = os.getenv('USE_TENSORRT', '0') == '1'
+
+# Serve the INT8 TFLite model instead of Keras (for CPU-only deployments)
+USE_TFLITE = os.getenv('USE_TFLITE', '0') == '1'
+
+# Enable XLA auto-clustering to fuse the TimeDistributed + LSTM graph
+USE_XLA = os.getenv('USE_XLA', '1') == '1'
+
+# TensorFlow CPU thread pools (ops run in parallel / independent ops at once)
+TF_NUM_INTRAOP_THREADS = int(os.getenv('TF_NUM_INTRAOP_THREADS', str(os.cpu_count() or 1)))
+TF_NUM_INTEROP_THREADS = int(os.getenv('TF_NUM_INTEROP_THREADS', '2'))
+
+# Model input shape (batch dimension excluded) and dtype
+INPUT_SHAPE = (20, 224, 224, 3)
+INPUT_DTYPE = 'uint8'
+
+# Number of prediction results kept in the LRU cache
+PREDICTION_CACHE_SIZE = int(os.getenv('PREDICTION_CACHE_SIZE', '128'))
 
 # Global variables for caching
 _model = None
+_predict_fn = None
 _class_labels = None
+_model_info = None
+_prediction_cache = OrderedDict()
+_prediction_cache_lock = threading.Lock()
+_load_lock = threading.Lock()
 
 
 def build_model():
     """Rebuild the CNN + LSTM model architecture"""
     from tensorflow.keras.applications import MobileNetV2
-    from tensorflow.keras.layers import TimeDistributed, LSTM, Dense, Dropout, Input
+    from tensorflow.keras.layers import (
+        TimeDistributed, LSTM, Dense, Dropout, Input, Rescaling
+    )
     from tensorflow.keras.models import Model
     
     SEQ_LENGTH = 20
@@ -37,8 +78,11 @@ def build_model():
     cnn.trainable = False
     
     # Build model
-    inputs = Input(shape=(SEQ_LENGTH, IMG_SIZE, IMG_SIZE, 3))
-    x = TimeDistributed(cnn)(inputs)
+    # Frames arrive as uint8; scale to [0, 1] as during training.
+    # Rescaling has no weights, so load_weights() still lines up.
+    inputs = Input(shape=(SEQ_LENGTH, IMG_SIZE, IMG_SIZE, 3), dtype='uint8')
+    x = Rescaling(1.0 / 255.0)(inputs)
+    x = TimeDistributed(cnn)(x)
     x = LSTM(64)(x)
     x = Dropout(0.5)(x)
     outputs = Dense(NUM_CLASSES, activation="softmax")(x)
@@ -47,6 +91,193 @@ def build_model():
     return model
 
 
+class TRTModel:
+    """
+    Wrap a TF-TRT converted SavedModel behind the Keras model(x) interface
+    
+    Attributes not defined here (input_shape, count_params, ...) are
+    forwarded to the original Keras model.
+    """
+    
+    def __init__(self, keras_model, saved_model_dir):
+        import tensorflow as tf
+        
+        self._keras_model = keras_model
+        self._loaded = tf.saved_model.load(saved_model_dir)
+        self._fn = self._loaded.signatures['serving_default']
+        self._input_name = list(self._fn.structured_input_signature[1].keys())[0]
+    
+    def __call__(self, x, training=False):
+        import tensorflow as tf
+        
+        outputs = self._fn(**{self._input_name: tf.convert_to_tensor(x, INPUT_DTYPE)})
+        return next(iter(outputs.values()))
+    
+    def __getattr__(self, name):
+        return getattr(self._keras_model, name)
+
+
+class TFLiteModel:
+    """
+    Run a TFLite model behind the Keras model(x) interface
+    
+    Uses tflite_runtime when installed (no full TensorFlow import),
+    otherwise tf.lite. The interpreter has a fixed batch size of 1, so
+    batched inputs are run one sample at a time; callers must serialize
+    access (the batcher holds a lock around every call).
+    """
+    
+    def __init__(self, model_path, num_threads=None):
+        try:
+            from tflite_runtime.interpreter import Interpreter
+        except ImportError:
+            import tensorflow as tf
+            Interpreter = tf.lite.Interpreter
+        
+        self._interpreter = Interpreter(
+            model_path=model_path, num_threads=num_threads or os.cpu_count()
+        )
+        self._interpreter.allocate_tensors()
+        self._input = self._interpreter.get_input_details()[0]
+        self._output = self._interpreter.get_output_details()[0]
+        self.input_shape = (None,) + tuple(self._input['shape'][1:])
+        self.output_shape = (None,) + tuple(self._output['shape'][1:])
+    
+    def __call__(self, x, training=False):
+        x = np.asarray(x, dtype=self._input['dtype'])
+        outputs = np.empty((len(x),) + self.output_shape[1:], dtype=np.float32)
+        for i in range(len(x)):
+            self._interpreter.set_tensor(self._input['index'], x[i:i + 1])
+            self._interpreter.invoke()
+            outputs[i] = self._interpreter.get_tensor(self._output['index'])[0]
+        return outputs
+
+
+def _calibration_clips(calib_dir, num_samples):
+    """List up to num_samples video files spread evenly across calib_dir"""
+    clips = []
+    for root, _, files in os.walk(calib_dir):
+        for name in files:
+            if name.rsplit('.', 1)[-1].lower() in CALIB_EXTENSIONS:
+                clips.append(os.path.join(root, name))
+    clips.sort()
+    # Stride through the sorted list so every class directory is represented
+    # rather than just the first one or two
+    return clips[::max(1, len(clips) // num_samples)][:num_samples]
+
+
+def convert_to_tflite(model, calib_dir=CALIB_DIR, output_path=TFLITE_MODEL_PATH,
+                      num_samples=100):
+    """
+    Quantize a Keras model to INT8 with post-training quantization
+    
+    Convolutions are quantized to INT8, with activation ranges calibrated
+    on real clips decoded exactly as /predict does; ops without an INT8
+    kernel (the LSTM) stay in float.
+    
+    Args:
+        model (tf.keras.Model): Model with trained weights loaded
+        calib_dir (str): Directory of sample videos used for calibration
+        output_path (str): Where to write the .tflite file
+        num_samples (int): Maximum number of clips used for calibration
+    
+    Returns:
+        str: Path of the written model
+    """
+    import tensorflow as tf
+    from video_utils import extract_frames
+    
+    clips = _calibration_clips(calib_dir, num_samples)
+    if not clips:
+        raise FileNotFoundError(
+            f"No calibration videos found in: {calib_dir}\n"
+            f"Add a few sample clips of each action before exporting."
+        )
+    print(f"Calibrating on {len(clips)} clips from: {calib_dir}")
+    
+    def representative_dataset():
+        for path in clips:
+            frames = extract_frames(path)
+            if frames is not None:
+                yield [frames[None, ...]]
+    
+    converter = tf.lite.TFLiteConverter.from_keras_model(model)
+    converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    converter.representative_dataset = representative_dataset
+    # Builtins only: tflite_runtime has no Flex delegate, so a model
+    # needing SELECT_TF_OPS would fail to load at serving time. Better
+    # for the export to fail here instead.
+    converter.target_spec.supported_ops = [
+        tf.lite.OpsSet.TFLITE_BUILTINS_INT8,
+        tf.lite.OpsSet.TFLITE_BUILTINS
+    ]
+    tflite_model = converter.convert()
+    
+    with open(output_path, 'wb') as f:
+        f.write(tflite_model)
+    
+    print(f"Saved INT8 TFLite model to: {output_path}")
+    return output_path
+
+
+def _trt_cache_path():
+    """Cache directory keyed by the weights file path, mtime and max batch size"""
+    key = f"{MODEL_PATH}:{os.path.getmtime(MODEL_PATH)}:{MAX_BATCH_SIZE}"
+    digest = hashlib.sha1(key.encode('utf-8')).hexdigest()[:16]
+    return os.path.join(TRT_CACHE_DIR, digest)
+
+
+def convert_to_tensorrt(model):
+    """
+    Convert a Keras model to a TF-TRT FP16 engine, caching it on disk
+    
+    The engine is rebuilt only when the weights file changes.
+    
+    Args:
+        model (tf.keras.Model): Model with trained weights loaded
+    
+    Returns:
+        TRTModel: Wrapper running inference through the TensorRT engine
+    """
+    import tensorflow as tf
+    from tensorflow.python.compiler.tensorrt import trt_convert as trt
+    
+    cache_dir = _trt_cache_path()
+    
+    if not os.path.exists(cache_dir):
+        print("Converting model to TF-TRT (FP16)...")
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            tf.saved_model.save(model, tmp_dir)
+            converter = trt.TrtGraphConverterV2(
+                input_saved_model_dir=tmp_dir,
+                conversion_params=trt.TrtConversionParams(
+                    precision_mode=trt.TrtPrecisionMode.FP16,
+                    max_workspace_size_bytes=1 << 30
+                )
+            )
+            converter.convert()
+            # Implicit-batch engines serve any batch up to the one they were
+            # built with, so build for the largest batch the batcher sends
+            converter.build(input_fn=lambda: [
+                (np.zeros((MAX_BATCH_SIZE,) + INPUT_SHAPE, np.uint8),)
+            ])
+            
+            # Save next to the final location and rename into place, so a
+            # process killed mid-save never leaves a partial cache_dir
+            os.makedirs(TRT_CACHE_DIR, exist_ok=True)
+            staging_dir = tempfile.mkdtemp(dir=TRT_CACHE_DIR, prefix='.tmp-')
+            try:
+                converter.save(staging_dir)
+                os.replace(staging_dir, cache_dir)
+            finally:
+                if os.path.exists(staging_dir):
+                    shutil.rmtree(staging_dir, ignore_errors=True)
+    else:
+        print(f"Loading cached TF-TRT engine from: {cache_dir}")
+    
+    return TRTModel(model, cache_dir)
+
+
 def load_model():
     """
     Load the pre-trained CNN + LSTM model
@@ -56,13 +287,52 @@ def load_model():
     - LSTM: 64 units for temporal sequence learning
     - Output: Softmax layer for 11 UCF11 action classes
     
+    With USE_TFLITE=1 the INT8 TFLite model is loaded instead
+    (see convert_to_tflite).
+    
     Returns:
         tf.keras.Model: Loaded model ready for inference
     """
-    global _model
+    global _model_info
+    
+    # _model_info is assigned last, so it marks a fully loaded model
+    if _model_info is None:
+        with _load_lock:
+            if _model_info is None:
+                _load_model()
+                _model_info = _build_model_info()
+    return _model
+
+
+def _load_tflite_model():
+    """Load the INT8 TFLite model and warm up its interpreter"""
+    global _model, _predict_fn
     
-    if _model is not None:
-        return _model
+    if not os.path.exists(TFLITE_MODEL_PATH):
+        raise FileNotFoundError(
+            f"TFLite model not found at: {TFLITE_MODEL_PATH}\n"
+            f"Run 'python model_loader.py --export-tflite' to create it."
+        )
+    
+    print(f"Loading TFLite model from: {TFLITE_MODEL_PATH}")
+    _model = TFLiteModel(TFLITE_MODEL_PATH)
+    _model(np.zeros((1,) + INPUT_SHAPE, dtype=np.uint8))
+    _predict_fn = _model
+    
+    print("Model loaded successfully!")
+    print(f"Input shape: {_model.input_shape}")
+    print(f"Output shape: {_model.output_shape}")
+
+
+def _load_model():
+    """Build the model, load its weights and warm up the predict function"""
+    if USE_TFLITE:
+        _load_tflite_model()
+        return
+    
+    import tensorflow as tf
+    
+    global _model, _predict_fn
     
     if not os.path.exists(MODEL_PATH):
         raise FileNotFoundError(
@@ -75,6 +345,16 @@ def load_model():
     # Suppress TensorFlow warnings
     tf.get_logger().setLevel('ERROR')
     
+    # Thread pools can only be sized before the TF runtime starts
+    try:
+        tf.config.threading.set_intra_op_parallelism_threads(TF_NUM_INTRAOP_THREADS)
+        tf.config.threading.set_inter_op_parallelism_threads(TF_NUM_INTEROP_THREADS)
+    except RuntimeError as e:
+        print(f"Warning: Could not set TensorFlow thread pools: {e}")
+    
+    if USE_XLA:
+        tf.config.optimizer.set_jit(True)
+    
     # Rebuild model architecture
     print("Building model architecture...")
     _model = build_model()
@@ -94,11 +374,78 @@ def load_model():
         metrics=['accuracy']
     )
     
+    if USE_TENSORRT:
+        try:
+            _model = convert_to_tensorrt(_model)
+        except Exception as e:
+            print(f"Warning: TF-TRT conversion failed: {e}")
+            print("Falling back to the Keras model")
+    
+    # Trace once with a fixed signature and pay cuDNN/XLA autotuning now
+    # rather than on the first real request. XLA and cuDNN compile per
+    # input shape, so run every batch size the batcher can send.
+    print(f"Warming up model for batch sizes 1-{MAX_BATCH_SIZE}...")
+    model = _model
+    _predict_fn = tf.function(
+        lambda x: model(x, training=False),
+        input_signature=[tf.TensorSpec((None,) + INPUT_SHAPE, INPUT_DTYPE)]
+    )
+    for batch_size in range(1, MAX_BATCH_SIZE + 1):
+        _predict_fn(tf.zeros((batch_size,) + INPUT_SHAPE, INPUT_DTYPE))
+    
     print("Model loaded successfully!")
     print(f"Input shape: {_model.input_shape}")
     print(f"Output shape: {_model.output_shape}")
+
+
+def get_predict_fn():
+    """
+    Get the traced inference function of the loaded model
     
-    return _model
+    The function takes a uint8 tensor of shape
+    (batch_size, 20, 224, 224, 3) and returns the class probabilities.
+    It is warmed up at load time, so the first request doesn't pay
+    for tracing or kernel autotuning.
+    
+    Returns:
+        tf.types.experimental.GenericFunction: Inference function
+    """
+    load_model()
+    return _predict_fn
+
+
+def get_cached_prediction(key):
+    """
+    Look up a prediction result by video content hash
+    
+    Args:
+        key (bytes): Digest of the uploaded video
+    
+    Returns:
+        dict: Cached prediction result, or None on a miss
+    """
+    with _prediction_cache_lock:
+        result = _prediction_cache.get(key)
+        if result is not None:
+            _prediction_cache.move_to_end(key)
+        return result
+
+
+def cache_prediction(key, result):
+    """
+    Store a prediction result, evicting the least recently used entry
+    
+    Args:
+        key (bytes): Digest of the uploaded video
+        result (dict): Prediction result to return on later hits
+    """
+    if PREDICTION_CACHE_SIZE <= 0:
+        return
+    with _prediction_cache_lock:
+        _prediction_cache[key] = result
+        _prediction_cache.move_to_end(key)
+        while len(_prediction_cache) > PREDICTION_CACHE_SIZE:
+            _prediction_cache.popitem(last=False)
 
 
 def get_class_labels():
@@ -111,21 +458,23 @@ def get_class_labels():
     - volleyball_spiking, walking
     
     Returns:
-        list: List of class label strings
+        tuple: Class label strings (loaded once at import)
     """
+    return _class_labels
+
+
+def _init_labels():
+    """Load the class labels from CLASSES_PATH, or fall back to the defaults"""
     global _class_labels
     
-    if _class_labels is not None:
-        return _class_labels
-    
     if os.path.exists(CLASSES_PATH):
         # Load from JSON file
         with open(CLASSES_PATH, 'r') as f:
             data = json.load(f)
-            _class_labels = data.get('classes', [])
+            _class_labels = tuple(data.get('classes', []))
     else:
         # Default UCF11 classes (sorted alphabetically as used in training)
-        _class_labels = [
+        _class_labels = (
             "basketball",
             "biking", 
             "diving",
@@ -137,27 +486,35 @@ def get_class_labels():
             "trampoline_jumping",
             "volleyball_spiking",
             "walking"
-        ]
-    
-    return _class_labels
+        )
+
+
+_init_labels()
 
 
 def get_model_info():
     """
     Get information about the loaded model
     
+    Computed once when the model is loaded, so repeated calls don't
+    re-count parameters.
+    
     Returns:
         dict: Model information including architecture and parameters
     """
-    model = load_model()
-    
+    load_model()
+    return _model_info
+
+
+def _build_model_info():
+    """Collect information about the freshly loaded model"""
     return {
-        'model_path': MODEL_PATH,
-        'input_shape': model.input_shape,
-        'output_shape': model.output_shape,
-        'total_params': model.count_params(),
-        'classes': get_class_labels(),
-        'num_classes': len(get_class_labels()),
+        'model_path': TFLITE_MODEL_PATH if USE_TFLITE else MODEL_PATH,
+        'input_shape': _model.input_shape,
+        'output_shape': _model.output_shape,
+        'total_params': _model.count_params() if hasattr(_model, 'count_params') else None,
+        'classes': _class_labels,
+        'num_classes': len(_class_labels),
         'architecture': {
             'cnn': 'MobileNetV2 (ImageNet pretrained)',
             'temporal': 'LSTM (64 units)',
@@ -168,6 +525,24 @@ def get_model_info():
 
 
 if __name__ == '__main__':
+    import sys
+    
+    if '--export-tflite' in sys.argv:
+        # Offline INT8 conversion for CPU deployment (USE_TFLITE=1)
+        # Usage: python model_loader.py --export-tflite [--calib-dir DIR]
+        calib_dir = CALIB_DIR
+        if '--calib-dir' in sys.argv:
+            calib_dir = sys.argv[sys.argv.index('--calib-dir') + 1]
+        
+        keras_model = build_model()
+        keras_model.load_weights(MODEL_PATH)
+        try:
+            convert_to_tflite(keras_model, calib_dir)
+        except FileNotFoundError as e:
+            print(f"Error: {e}")
+            sys.exit(1)
+        sys.exit(0)
+    
     # Test model loading
     print("Testing model loader...")
     
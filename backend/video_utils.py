@@ -3,6 +3,13 @@ Video Processing Utilities for Action Recognition
 Handles frame extraction and preprocessing for CNN + LSTM model
 """
 
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+from contextlib import contextmanager
+
 import numpy as np
 import cv2
 import imageio.v2 as imageio
@@ -11,6 +18,58 @@ import imageio.v2 as imageio
 SEQ_LENGTH = 20      # Number of frames to extract
 IMG_SIZE = 224       # Frame dimensions (224x224)
 CHANNELS = 3         # RGB channels
+STREAM_CHUNK_SIZE = 64 * 1024  # Bytes per write when piping uploads to ffmpeg
+
+
+def _find_ffmpeg():
+    """Locate an ffmpeg binary (bundled imageio-ffmpeg first, then PATH)"""
+    try:
+        import imageio_ffmpeg
+        return imageio_ffmpeg.get_ffmpeg_exe()
+    except Exception:
+        return shutil.which('ffmpeg')
+
+
+FFMPEG_BIN = _find_ffmpeg()
+
+
+def _read_into(stream, buf):
+    """
+    Fill a writable buffer from a binary stream until it is full or EOF
+
+    Returns:
+        int: Number of bytes read
+    """
+    view = memoryview(buf).cast('B')
+    total = 0
+    while total < len(view):
+        n = stream.readinto(view[total:])
+        if not n:
+            break
+        total += n
+    return total
+
+
+def _count_frames(video_path):
+    """
+    Read the frame count from the container header (0 if unknown)
+    """
+    cap = cv2.VideoCapture(video_path)
+    try:
+        if not cap.isOpened():
+            return 0
+        return max(0, int(cap.get(cv2.CAP_PROP_FRAME_COUNT)))
+    finally:
+        cap.release()
+
+
+def _sample_filter(indices, img_size):
+    """
+    Build the ffmpeg -vf chain that keeps exactly the given frame indices
+    and scales them to img_size x img_size
+    """
+    select = '+'.join(f'eq(n\\,{i})' for i in indices)
+    return f"select='{select}',scale={img_size}:{img_size},format=rgb24"
 
 
 def extract_frames(video_path, seq_length=SEQ_LENGTH, img_size=IMG_SIZE):
@@ -18,11 +77,18 @@ def extract_frames(video_path, seq_length=SEQ_LENGTH, img_size=IMG_SIZE):
     Extract frames from a video file
     
     This function:
-    1. Opens the video using imageio (supports multiple formats)
-    2. Extracts up to seq_length frames
-    3. Resizes each frame to img_size x img_size
-    4. Normalizes pixel values to [0, 1]
-    5. Pads with zeros if video has fewer frames
+    1. Spawns a single ffmpeg process that selects seq_length evenly
+       spaced frame indices, resizes them to img_size x img_size
+       and converts to RGB24 in C
+    2. Reads the raw frames from its stdout straight into
+       a preallocated uint8 buffer
+    3. If the container's frame count is missing, too small or wrong,
+       decodes the whole clip and keeps evenly spread frames instead
+    4. Pads with zeros only if the video is shorter than seq_length
+    
+    Pixel values are left as uint8 in [0, 255]; the model rescales them.
+    
+    Falls back to OpenCV if no ffmpeg binary is available.
     
     Args:
         video_path (str): Path to the video file
@@ -33,102 +99,335 @@ def extract_frames(video_path, seq_length=SEQ_LENGTH, img_size=IMG_SIZE):
         numpy.ndarray: Array of shape (seq_length, img_size, img_size, 3)
                       or None if extraction fails
     """
-    frames = []
+    if FFMPEG_BIN is None:
+        print("ffmpeg not found, falling back to OpenCV")
+        return _extract_frames_fallback(video_path, seq_length, img_size)
     
-    try:
-        # Try to open video with imageio (ffmpeg backend)
-        reader = imageio.get_reader(video_path, format='ffmpeg')
-        
-        # Get video metadata
+    total = _count_frames(video_path)
+    
+    if total >= seq_length:
+        # Same evenly spaced indices as the OpenCV path, plus index `total`
+        # as a probe: if that frame exists the header under-reported the count
+        indices = np.linspace(0, total - 1, seq_length).astype(int)
+        out = np.empty((seq_length, img_size, img_size, CHANNELS), dtype=np.uint8)
+        cmd = [
+            FFMPEG_BIN, '-i', video_path,
+            '-vf', _sample_filter(list(indices) + [total], img_size),
+            '-vsync', '0',  # Don't duplicate frames to fill gaps left by select
+            '-vframes', str(seq_length + 1),
+            '-f', 'rawvideo', '-'
+        ]
         try:
-            meta = reader.get_meta_data()
-            total_frames = meta.get('nframes', float('inf'))
-            fps = meta.get('fps', 30)
-            duration = meta.get('duration', 0)
-            print(f"Video info: {total_frames} frames, {fps} fps, {duration:.2f}s duration")
-        except:
-            pass
+            proc = subprocess.Popen(
+                cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL
+            )
+            try:
+                bytes_read = _read_into(proc.stdout, out)
+                past_end = bool(proc.stdout.read(1))
+            finally:
+                proc.stdout.close()
+                proc.wait()
+        except Exception as e:
+            print(f"Error extracting frames with ffmpeg: {e}")
+            return _extract_frames_fallback(video_path, seq_length, img_size)
         
-        # Extract frames
-        for i, frame in enumerate(reader):
-            if i >= seq_length:
-                break
-            
-            # Resize frame
-            frame_resized = cv2.resize(frame, (img_size, img_size))
-            
-            # Normalize to [0, 1]
-            frame_normalized = frame_resized / 255.0
-            
-            frames.append(frame_normalized)
-        
-        reader.close()
+        if bytes_read == out.nbytes and not past_end:
+            print(f"Extracted {seq_length} frames successfully")
+            return out
         
+        # The header count was wrong (common with AVI/MPEG-PS): either some
+        # indices were never reached, or frames exist past the reported end
+        # and the selection only covered the start. Decode the whole clip.
+        print(f"Frame count {total} from header is wrong, decoding full clip")
+    
+    frames = _decode_evenly(video_path, seq_length, img_size)
+    if frames is None:
+        print("No frames extracted from video")
+    return frames
+
+
+def _extract_frames_fallback(video_path, seq_length, img_size):
+    """Extract frames with OpenCV into a zero-padded buffer"""
+    # Unwritten trailing frames are already the zero padding
+    out = np.zeros((seq_length, img_size, img_size, CHANNELS), dtype=np.uint8)
+    try:
+        frames = extract_frames_opencv(video_path, seq_length, img_size, out=out)
     except Exception as e:
-        print(f"Error extracting frames with imageio: {e}")
-        
-        # Fallback to OpenCV
+        print(f"Error with OpenCV fallback: {e}")
+        return None
+    
+    if frames is None or len(frames) == 0:
+        print("No frames extracted from video")
+        return None
+    
+    # Frames beyond len(frames) stay zero (padding)
+    print(f"Extracted {len(frames)} frames successfully")
+    return out
+
+
+def is_seekable(stream):
+    """
+    Check whether a stream can be rewound
+    
+    SpooledTemporaryFile (Werkzeug's multipart upload storage) only has
+    seekable() from Python 3.11, so fall back to checking for seek().
+    """
+    if hasattr(stream, 'seekable'):
+        return stream.seekable()
+    return hasattr(stream, 'seek')
+
+
+def _pipe_stream(stream, stdin, hasher=None, errors=None):
+    """
+    Copy an upload stream into ffmpeg's stdin in fixed-size chunks
+    
+    Errors reading the upload (client disconnect, body over the size
+    limit) are appended to errors so the caller can re-raise them
+    instead of predicting on a truncated prefix.
+    """
+    piping = True
+    try:
+        while True:
+            chunk = stream.read(STREAM_CHUNK_SIZE)
+            if not chunk:
+                break
+            if hasher is not None:
+                hasher.update(chunk)
+            if piping:
+                try:
+                    stdin.write(chunk)
+                except (BrokenPipeError, ValueError):
+                    # ffmpeg exited early (e.g. unsupported input); keep
+                    # draining if the hash has to cover the whole upload
+                    piping = False
+                    if hasher is None:
+                        break
+    except Exception as e:
+        if errors is not None:
+            errors.append(e)
+    finally:
         try:
-            frames = extract_frames_opencv(video_path, seq_length, img_size)
-            if frames is None or len(frames) == 0:
-                return None
-        except Exception as e2:
-            print(f"Error with OpenCV fallback: {e2}")
-            return None
-    
-    if len(frames) == 0:
+            stdin.close()
+        except BrokenPipeError:
+            pass
+
+
+def extract_frames_from_stream(stream, seq_length=SEQ_LENGTH, img_size=IMG_SIZE,
+                               hasher=None):
+    """
+    Extract frames from an upload stream without writing it to disk
+    
+    The stream is copied into ffmpeg's stdin on a background thread while
+    scaled RGB24 frames are read from its stdout. As the frame count is not
+    known up front, evenly spread frames are kept with a doubling stride
+    (see _decode_evenly).
+    
+    Seekable streams (e.g. spooled multipart uploads) are written to a
+    temporary file and decoded with extract_frames() instead, which can
+    seek to the sampled frames and handles MP4s whose index is stored at
+    the end, something ffmpeg cannot read from a pipe.
+    
+    Args:
+        stream: Binary file-like object with the video bytes
+        seq_length (int): Number of frames to extract (default: 20)
+        img_size (int): Size to resize frames (default: 224)
+        hasher: Optional hashlib object updated with every byte piped to
+                ffmpeg, so the upload can be hashed without a second pass
+    
+    Returns:
+        numpy.ndarray: Array of shape (seq_length, img_size, img_size, 3)
+                      or None if extraction fails
+    """
+    if FFMPEG_BIN is None or is_seekable(stream):
+        return _extract_frames_from_tempfile(stream, seq_length, img_size, hasher)
+    
+    frames = _decode_evenly('pipe:0', seq_length, img_size, stream, hasher)
+    if frames is None:
         print("No frames extracted from video")
+    return frames
+
+
+def _decode_evenly(source, seq_length, img_size, stream=None, hasher=None):
+    """
+    Decode every frame of a video with ffmpeg, keeping seq_length evenly
+    spread ones without knowing the frame count up front
+    
+    At most 2 * seq_length frames are kept: whenever the buffer fills,
+    every other frame is dropped and the sampling stride doubles.
+    
+    Args:
+        source (str): ffmpeg input (a path, or 'pipe:0' with stream)
+        seq_length (int): Number of frames to extract
+        img_size (int): Size to resize frames
+        stream: Binary file-like object piped into ffmpeg's stdin
+        hasher: Optional hashlib object updated with the piped bytes
+    
+    Returns:
+        numpy.ndarray: Array of shape (seq_length, img_size, img_size, 3)
+                      zero-padded for short clips, or None if no frames
+                      were decoded
+    """
+    cmd = [
+        FFMPEG_BIN, '-i', source,
+        '-vf', f'scale={img_size}:{img_size},format=rgb24',
+        '-vsync', '0',
+        '-f', 'rawvideo', 'pipe:1'
+    ]
+    capacity = 2 * seq_length
+    kept = np.empty((capacity, img_size, img_size, CHANNELS), dtype=np.uint8)
+    scratch = np.empty((img_size, img_size, CHANNELS), dtype=np.uint8)
+    count = 0
+    stride = 1
+    errors = []
+    
+    try:
+        proc = subprocess.Popen(
+            cmd,
+            stdin=subprocess.PIPE if stream is not None else subprocess.DEVNULL,
+            stdout=subprocess.PIPE, stderr=subprocess.DEVNULL
+        )
+        writer = None
+        if stream is not None:
+            writer = threading.Thread(
+                target=_pipe_stream, args=(stream, proc.stdin, hasher, errors),
+                daemon=True
+            )
+            writer.start()
+        try:
+            frame_index = 0
+            while True:
+                target = kept[count] if frame_index % stride == 0 else scratch
+                if _read_into(proc.stdout, target) < scratch.nbytes:
+                    break
+                if target is not scratch:
+                    count += 1
+                    if count == capacity:
+                        kept[:seq_length] = kept[::2]
+                        count = seq_length
+                        stride *= 2
+                frame_index += 1
+        finally:
+            proc.stdout.close()
+            if writer is not None:
+                writer.join()
+            proc.wait()
+    except Exception as e:
+        print(f"Error extracting frames with ffmpeg: {e}")
+        count = 0
+    
+    # The upload itself failed; don't predict on a partial video
+    if errors:
+        raise errors[0]
+    
+    if count == 0:
         return None
     
-    # Pad with zeros if we have fewer frames than required
-    while len(frames) < seq_length:
-        frames.append(np.zeros((img_size, img_size, CHANNELS)))
+    if count >= seq_length:
+        indices = np.linspace(0, count - 1, seq_length).astype(int)
+        # Compact into the head of the buffer in place; indices are sorted
+        # with indices[i] >= i, so each source is read before it is overwritten
+        for i, src in enumerate(indices):
+            if src != i:
+                kept[i] = kept[src]
+        frames = kept[:seq_length]
+    else:
+        # Short clip: zero the tail in place (it may hold a partial read)
+        # and return a view instead of copying into a new padded array
+        kept[count:seq_length] = 0
+        frames = kept[:seq_length]
     
-    print(f"Extracted {len(frames)} frames successfully")
-    return np.array(frames, dtype=np.float32)
+    print(f"Extracted {min(count, seq_length)} frames successfully")
+    return frames
+
+
+@contextmanager
+def upload_tempfile(stream, hasher=None):
+    """
+    Copy an upload into a temporary file in a single pass
+    
+    Args:
+        stream: Binary file-like object with the video bytes
+        hasher: Optional hashlib object updated while copying, so the
+                upload is hashed without reading it a second time
+    
+    Yields:
+        str: Path of the temporary file (removed on exit)
+    """
+    if is_seekable(stream):
+        stream.seek(0)
+    fd, path = tempfile.mkstemp()
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            for chunk in iter(lambda: stream.read(STREAM_CHUNK_SIZE), b''):
+                if hasher is not None:
+                    hasher.update(chunk)
+                f.write(chunk)
+        yield path
+    finally:
+        os.remove(path)
+
 
+def _extract_frames_from_tempfile(stream, seq_length, img_size, hasher=None):
+    """Write a stream to a temporary file and decode it from disk"""
+    with upload_tempfile(stream, hasher) as path:
+        return extract_frames(path, seq_length, img_size)
 
-def extract_frames_opencv(video_path, seq_length=SEQ_LENGTH, img_size=IMG_SIZE):
+
+def extract_frames_opencv(video_path, seq_length=SEQ_LENGTH, img_size=IMG_SIZE,
+                          out=None):
     """
     Fallback frame extraction using OpenCV
     
+    Seeks to seq_length evenly spaced frame indices when the frame count
+    is known, otherwise reads sequentially from the start.
+    
     Args:
         video_path (str): Path to the video file
         seq_length (int): Number of frames to extract
         img_size (int): Size to resize frames
+        out (numpy.ndarray): Optional uint8 buffer of shape
+                             (seq_length, img_size, img_size, 3) to decode into
     
     Returns:
-        list: List of normalized frame arrays
+        numpy.ndarray: uint8 RGB frames of shape (n, img_size, img_size, 3)
+                      with n <= seq_length (a view of out), or None if the
+                      video can't be opened
     """
-    frames = []
+    if out is None:
+        out = np.empty((seq_length, img_size, img_size, CHANNELS), dtype=np.uint8)
+    count = 0
     cap = cv2.VideoCapture(video_path)
     
     if not cap.isOpened():
         print(f"Could not open video: {video_path}")
         return None
     
-    frame_count = 0
+    total = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
     
-    while frame_count < seq_length:
+    if total >= seq_length:
+        # Sample seq_length frames evenly across the whole clip
+        indices = np.linspace(0, total - 1, seq_length).astype(int)
+    else:
+        # Short or unknown length: read sequentially from the start
+        indices = [None] * seq_length
+    
+    for idx in indices:
+        if idx is not None:
+            cap.set(cv2.CAP_PROP_POS_FRAMES, int(idx))
         ret, frame = cap.read()
         
         if not ret:
             break
         
-        # Convert BGR to RGB
-        frame_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-        
-        # Resize
-        frame_resized = cv2.resize(frame_rgb, (img_size, img_size))
-        
-        # Normalize
-        frame_normalized = frame_resized / 255.0
-        
-        frames.append(frame_normalized)
-        frame_count += 1
+        # Resize straight into the output slot, then convert BGR to RGB in place.
+        # (cv2.dnn.blobFromImages would need every full-resolution frame held
+        # at once and returns NCHW, costing an extra transpose copy to NHWC.)
+        cv2.resize(frame, (img_size, img_size), dst=out[count])
+        cv2.cvtColor(out[count], cv2.COLOR_BGR2RGB, dst=out[count])
+        count += 1
     
     cap.release()
-    return frames
+    return out[:count]
 
 
 def preprocess_video(frames):
@@ -136,7 +435,8 @@ def preprocess_video(frames):
     Preprocess extracted frames for model input
     
     The model expects input shape: (batch_size, seq_length, img_size, img_size, 3)
-    This function adds the batch dimension.
+    This function adds the batch dimension. Frames stay uint8; scaling to
+    [0, 1] happens inside the model.
     
     Args:
         frames (numpy.ndarray): Array of shape (seq_length, img_size, img_size, 3)
@@ -157,9 +457,6 @@ def preprocess_video(frames):
     else:
         raise ValueError(f"Invalid frames shape: {frames.shape}")
     
-    # Ensure float32 type
-    processed = processed.astype(np.float32)
-    
     print(f"Preprocessed video shape: {processed.shape}")
     return processed
 